@@ -1,13 +1,33 @@
 import os
+import asyncio
+import aiohttp
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import argparse
 import re
 import json
 import subprocess
+import sys
 import difflib
-from openai import OpenAI
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import lru_cache
+from diskcache import Cache
+from openai import AsyncOpenAI, OpenAI
+from packaging.version import InvalidVersion, Version
 from colorama import init, Fore, Style
+from operator import itemgetter
 from pathlib import Path
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
 
 # --- Initialize Colorama & Global Setup ---
 init(autoreset=True)
@@ -17,11 +37,72 @@ if "OPENAI_API_KEY" not in os.environ:
 client = OpenAI()
 GITHUB_TOKEN = os.environ.get("GITHUB_TOKEN")
 HEADERS = {"Authorization": f"token {GITHUB_TOKEN}"} if GITHUB_TOKEN else {}
+CACHE = Cache(".package_doctor_cache")
+CACHE_TTL = 30 * 86400
+DEFAULT_MODEL = "gpt-4o-mini"
+DEFAULT_ESCALATE_MODEL = "gpt-4o"
+RISK_ORDER = {"DANGEROUS": 0, "CAUTION": 1, "SAFE": 2, "UNKNOWN": 3}
+MAX_WORKERS = 16
+NPM_FETCH_WORKERS = 32
+MAX_CHANGELOG_TOKENS = 6000
+CHANGELOG_HEADING = re.compile(r"^#{1,4}\s*(?:Version:\s*)?\[?(?:[\w@/.-]*@)?v?(\d+\.\d+(?:\.\d+)?)", re.MULTILINE)
+BREAKING_CHANGE_SIGNALS = re.compile(r"\b(breaking|removed?|deprecat\w*|migrat\w*|no longer|renamed)\b", re.IGNORECASE)
+CHANGELOG_FILENAMES = ["CHANGELOG.md", "CHANGELOG", "changelog.md", "History.md", "NEWS.md"]
+SOURCE_EXTENSIONS = (".js", ".jsx", ".ts", ".tsx")
+PRUNED_DIRS = {"node_modules", ".git", "dist", "build", ".next"}
+MAX_SOURCE_FILE_BYTES = 512_000
+MAX_DIFF_LINES = 5000
+PATCH_CONCURRENCY = 8
+PATCH_BATCH_SIZE = 5
+PATCH_BATCH_MAX_CHARS = 30000
+# One pooled session for the whole run so every worker reuses keep-alive connections.
+# The GitHub token is passed per request to api.github.com only, never to npm.
+SESSION = requests.Session()
+SESSION.mount("https://", HTTPAdapter(pool_connections=32, pool_maxsize=32, max_retries=Retry(total=2, backoff_factor=0.3, status_forcelist=[502, 503, 504])))
+PRINT_LOCK = threading.Lock()
+_task_log = threading.local()
+
+def log(message=""):
+    # Inside a worker task, buffer output so each package's log is printed as one block.
+    lines = getattr(_task_log, "lines", None)
+    if lines is not None: lines.append(message)
+    else: print(message)
 
 # --- Helper, NPM, and Changelog Functions (Unchanged) ---
+def chat_cache_key(messages, kwargs):
+    # Identical requests (same model, prompts and options) are answered from the on-disk cache.
+    return hashlib.sha256(json.dumps({"messages": messages, "kwargs": kwargs}, sort_keys=True).encode()).hexdigest()
+
+def cached_chat(messages, **kwargs):
+    key = chat_cache_key(messages, kwargs)
+    cached = CACHE.get(key)
+    if cached is not None: return cached
+    response = client.chat.completions.create(messages=messages, **kwargs)
+    content = response.choices[0].message.content
+    CACHE.set(key, content, expire=CACHE_TTL)
+    return content
+
+async def cached_chat_async(aclient, messages, **kwargs):
+    key = chat_cache_key(messages, kwargs)
+    cached = CACHE.get(key)
+    if cached is not None: return cached
+    response = await aclient.chat.completions.create(messages=messages, **kwargs)
+    content = response.choices[0].message.content
+    CACHE.set(key, content, expire=CACHE_TTL)
+    return content
+
+def read_json(file_path):
+    # orjson.JSONDecodeError subclasses json.JSONDecodeError, so callers catch the same error either way.
+    if orjson: return orjson.loads(Path(file_path).read_bytes())
+    with open(file_path, 'r') as f: return json.load(f)
+
+def write_json(file_path, data):
+    if orjson: Path(file_path).write_bytes(orjson.dumps(data, option=orjson.OPT_INDENT_2 | orjson.OPT_APPEND_NEWLINE)); return
+    with open(file_path, 'w') as f: json.dump(data, f, indent=2); f.write("\n")
+
 def parse_package_json(file_path):
     try:
-        with open(file_path, 'r') as f: data = json.load(f)
+        data = read_json(file_path)
         dependencies = data.get("dependencies", {})
         dev_dependencies = data.get("devDependencies", {})
         all_dependencies = {**dependencies, **dev_dependencies}
@@ -29,46 +110,119 @@ def parse_package_json(file_path):
     except (FileNotFoundError, json.JSONDecodeError) as e:
         print(Fore.RED + f"Error reading package.json: {e}"); return None
 
+def satisfies_range(version, version_range):
+    # Understands the common npm forms (exact, ^x.y.z, ~x.y.z); returns None for anything else (||, x-ranges, tags, urls).
+    match = re.fullmatch(r"([~^]?)v?(\d+\.\d+\.\d+(?:[-+][\w.+-]*)?)", version_range.strip())
+    if not match: return None
+    try: candidate, base = Version(version), Version(match.group(2))
+    except InvalidVersion: return None
+    prefix = match.group(1)
+    if not prefix: return candidate == base
+    if candidate < base: return False
+    if prefix == "~": return candidate.release[:2] == base.release[:2]
+    # Caret ranges allow changes that keep the left-most non-zero component.
+    major, minor = base.release[:2]
+    if major: return candidate.major == major
+    if minor: return candidate.major == 0 and candidate.minor == minor
+    return candidate == base
+
+def cached_get_json(url, headers=None):
+    # The on-disk copy is revalidated with If-None-Match; a 304 reuses its body without downloading it again.
+    cache_key = ("http", url)
+    cached = CACHE.get(cache_key)
+    request_headers = {**(headers or {}), **({"If-None-Match": cached["etag"]} if cached else {})}
+    response = SESSION.get(url, headers=request_headers, timeout=10)
+    if response.status_code == 304 and cached: return cached["body"]
+    response.raise_for_status()
+    body = response.json()
+    if response.headers.get("ETag"): CACHE.set(cache_key, {"etag": response.headers["ETag"], "body": body}, expire=CACHE_TTL)
+    return body
+
+@lru_cache(maxsize=4096)
 def get_npm_package_info(package_name):
     url = f"https://registry.npmjs.org/{package_name}/latest"
-    try:
-        response = requests.get(url, timeout=10); response.raise_for_status(); return response.json()
+    try: return cached_get_json(url)
     except requests.exceptions.RequestException: return None
 
+def fetch_latest_infos(package_names):
+    # Query the registry for every package up front so analysis never waits on npm one package at a time.
+    with ThreadPoolExecutor(max_workers=NPM_FETCH_WORKERS) as executor:
+        return dict(zip(package_names, executor.map(get_npm_package_info, package_names)))
+
+async def _fetch_text(session, url):
+    try:
+        async with session.get(url) as response:
+            return await response.text() if response.status == 200 else None
+    except (aiohttp.ClientError, asyncio.TimeoutError, UnicodeDecodeError): return None
+
+async def _fetch_texts(urls):
+    async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=10)) as session:
+        return await asyncio.gather(*(_fetch_text(session, url) for url in urls))
+
+def find_raw_file(repo_name, branches, paths):
+    # Probe every branch/path candidate at once; gather keeps candidate order, so the first hit respects priority.
+    urls = [f"https://raw.githubusercontent.com/{repo_name}/{branch}/{path}" for branch in branches for path in paths]
+    return next((text for text in asyncio.run(_fetch_texts(urls)) if text), None)
+
+@lru_cache(maxsize=4096)
 def get_changelog(repo_url, repo_directory=None):
     if not repo_url or "github.com" not in repo_url: return None
     match = re.search(r"github\.com/([^/]+/[^/]+?)(\.git)?$", repo_url)
     if not match: return None
     repo_name = match.group(1)
-    try:
-        api_url = f"https://api.github.com/repos/{repo_name}"
-        response = requests.get(api_url, headers=HEADERS, timeout=10); response.raise_for_status()
-        default_branch = response.json().get("default_branch")
-        changelog_filenames = ["CHANGELOG.md", "CHANGELOG", "changelog.md", "History.md", "NEWS.md"]
-        search_paths = [repo_directory] if repo_directory and repo_directory != "." else [""]
-        for path in search_paths:
-            if path is None: continue
-            for filename in changelog_filenames:
-                full_path = f"{path}/{filename}" if path else filename
-                raw_url = f"https://raw.githubusercontent.com/{repo_name}/{default_branch}/{full_path}"
-                try:
-                    res = requests.get(raw_url, timeout=10)
-                    if res.status_code == 200: return res.text[:40000]
-                except requests.exceptions.RequestException: continue
-    except requests.exceptions.RequestException: pass
+    full_paths = [f"{repo_directory}/{filename}" if repo_directory and repo_directory != "." else filename for filename in CHANGELOG_FILENAMES]
+    changelog = find_raw_file(repo_name, ["main", "master"], full_paths)
+    if not changelog:
+        # Only ask the GitHub API for the default branch when it is neither main nor master.
+        try:
+            api_url = f"https://api.github.com/repos/{repo_name}"
+            default_branch = cached_get_json(api_url, HEADERS).get("default_branch")
+            if default_branch and default_branch not in ("main", "master"):
+                changelog = find_raw_file(repo_name, [default_branch], full_paths)
+        except requests.exceptions.RequestException: pass
+    if changelog: return changelog
     releases_api_url = f"https://api.github.com/repos/{repo_name}/releases"
     try:
-        response = requests.get(releases_api_url, headers=HEADERS, timeout=10); response.raise_for_status()
-        releases_data = response.json()
+        releases_data = cached_get_json(releases_api_url, HEADERS)
         if not releases_data: return None
         synthetic_changelog = "".join([f"## Version: {r.get('tag_name', 'N/A')}\n\n{r.get('body')}\n\n---\n" for r in releases_data[:20] if r.get('body')])
         return synthetic_changelog if synthetic_changelog else None
     except requests.exceptions.RequestException: return None
     return None
 
+def parse_version(version):
+    try: return Version(version)
+    except InvalidVersion: return None
+
+@lru_cache(maxsize=None)
+def token_encoding():
+    if not tiktoken: return None
+    try: return tiktoken.encoding_for_model("gpt-4o")
+    except Exception: return None
+
+def truncate_to_tokens(text, max_tokens):
+    encoding = token_encoding()
+    if encoding is None: return text[:max_tokens * 4]  # Roughly 4 characters per token.
+    tokens = encoding.encode(text, disallowed_special=())
+    return text if len(tokens) <= max_tokens else encoding.decode(tokens[:max_tokens])
+
+def trim_changelog(changelog, current_version, latest_version):
+    # Keep only the sections for versions in (current, latest], then cap the result by token count.
+    current, latest = parse_version(current_version), parse_version(latest_version)
+    headings = list(CHANGELOG_HEADING.finditer(changelog))
+    if current and latest and headings:
+        sections = []
+        for i, heading in enumerate(headings):
+            version = parse_version(heading.group(1))
+            if version and current < version <= latest:
+                end = headings[i + 1].start() if i + 1 < len(headings) else len(changelog)
+                sections.append(changelog[heading.start():end])
+        if sections: changelog = "".join(sections)
+    return truncate_to_tokens(changelog, MAX_CHANGELOG_TOKENS)
+
 # --- Main Analysis & File Scanning Functions ---
-def summarize_and_classify_changes(package_name, changelog_content, missing_peers=None):
-    print(Style.DIM + f"-> Performing high-level analysis for '{package_name}'...")
+def summarize_and_classify_changes(package_name, changelog_content, missing_peers=None, model=DEFAULT_MODEL):
+    log(Style.DIM + f"-> Performing high-level analysis for '{package_name}'...")
     system_prompt = (
         "You are an expert software engineer's assistant. Your task is to analyze a "
         "changelog and classify the update risk. First, on a new line, write 'RISK:', "
@@ -85,8 +239,7 @@ def summarize_and_classify_changes(package_name, changelog_content, missing_peer
     user_prompt = (f"Analyze the changelog for '{package_name}'.\n{peer_context}\n\n"
                    f"Please classify the update risk and then provide your summary.\n\nChangelog:\n{changelog_content}")
     try:
-        response = client.chat.completions.create(model="gpt-4o", messages=[{"role": "system", "content": system_prompt}, {"role": "user", "content": user_prompt}], temperature=0.1, max_tokens=500)
-        content = response.choices[0].message.content.strip()
+        content = cached_chat([{"role": "system", "content": system_prompt}, {"role": "user", "content": user_prompt}], model=model, temperature=0.1, max_tokens=500).strip()
         lines = content.split('\n'); risk_line = lines[0]; summary = "\n".join(lines[1:]).strip()
         if missing_peers and "SAFE" in risk_line: risk = "CAUTION"
         elif "DANGEROUS" in risk_line: risk = "DANGEROUS"
@@ -96,43 +249,103 @@ def summarize_and_classify_changes(package_name, changelog_content, missing_peer
     except Exception as e:
         return "UNKNOWN", f"An error occurred with the OpenAI API: {e}"
 
-def find_relevant_files(src_dir, package_name):
+def build_source_index(src_dir):
+    # Walk and read the source tree once; every package's deep scan then searches these cached contents.
     if not src_dir: return {}
-    relevant_files = {}; src_path = Path(src_dir)
+    source_index = {}; src_path = Path(src_dir)
     if not src_path.is_dir(): return {}
-    print(Style.DIM + f"-> Scanning '{src_dir}' for files using '{package_name}' (excluding node_modules)...")
-    for ext in ["*.js", "*.jsx", "*.ts", "*.tsx"]:
-        for file_path in src_path.rglob(ext):
-            if "node_modules" in file_path.parts: continue
+    print(Style.DIM + f"-> Indexing '{src_dir}' (excluding {', '.join(sorted(PRUNED_DIRS))})...")
+    for dirpath, dirnames, filenames in os.walk(src_path):
+        dirnames[:] = [d for d in dirnames if d not in PRUNED_DIRS]
+        for filename in filenames:
+            if not filename.endswith(SOURCE_EXTENSIONS): continue
+            file_path = Path(dirpath) / filename
             try:
-                content = file_path.read_text(encoding='utf-8')
-                if re.search(fr'from ["\']{package_name}["\']|require\(["\']{package_name}["\']\)', content):
-                    relevant_files[str(file_path)] = content
-            except Exception: continue
+                # Minified bundles and generated files are skipped; contents stay as bytes until a package matches.
+                if file_path.stat().st_size > MAX_SOURCE_FILE_BYTES: continue
+                source_index[str(file_path)] = file_path.read_bytes()
+            except OSError: continue
+    return source_index
+
+def find_relevant_files(source_index, package_name):
+    if not source_index: return {}
+    log(Style.DIM + f"-> Scanning {len(source_index)} source files for '{package_name}'...")
+    escaped = re.escape(package_name)
+    import_pattern = re.compile(rf'from ["\']{escaped}["\']|require\(\s*["\']{escaped}["\']\s*\)')
+    # Any import of the package must contain its full name literally, so a byte substring test rejects most files
+    # before they are decoded or the regex runs.
+    package_bytes = package_name.encode()
+    relevant_files = {}
+    for file_path, data in source_index.items():
+        if package_bytes not in data: continue
+        try: content = data.decode('utf-8')
+        except UnicodeDecodeError: continue
+        if import_pattern.search(content): relevant_files[file_path] = content
     return relevant_files
 
-def get_code_patches(package_name, changelog_content, relevant_files):
-    print(Style.DIM + f"-> Performing deep scan for '{package_name}' on {len(relevant_files)} files...")
+def batch_files(relevant_files):
+    # Group files so the changelog is sent once per batch; oversized files end up in a batch of their own.
+    batches, batch, batch_chars = [], {}, 0
+    for file_path, content in relevant_files.items():
+        if batch and (len(batch) >= PATCH_BATCH_SIZE or batch_chars + len(content) > PATCH_BATCH_MAX_CHARS):
+            batches.append(batch); batch, batch_chars = {}, 0
+        batch[file_path] = content; batch_chars += len(content)
+    if batch: batches.append(batch)
+    return batches
+
+async def request_patches(aclient, system_prompt, files, model):
+    # Returns {path: new_content} for the files the model actually changed.
+    files_payload = json.dumps([{"path": file_path, "content": content} for file_path, content in files.items()], indent=2)
+    user_prompt = ("Rewrite the following code files to be compatible with the breaking changes described. Do not add any new functionality.\n"
+                   f"Files:\n{files_payload}")
+    analysis = json.loads(await cached_chat_async(aclient, [{"role": "system", "content": system_prompt}, {"role": "user", "content": user_prompt}], model=model, response_format={"type": "json_object"}, temperature=0.0))
+    patches = {}
+    for patch in analysis.get("patches", []):
+        file_path, new_content = patch.get("path"), patch.get("new_content")
+        if file_path in files and new_content and new_content != files[file_path]:
+            patches[file_path] = new_content
+    return patches
+
+def get_code_patches(package_name, changelog_content, relevant_files, model=DEFAULT_MODEL, escalate_model=DEFAULT_ESCALATE_MODEL):
+    log(Style.DIM + f"-> Performing deep scan for '{package_name}' on {len(relevant_files)} files...")
     system_prompt_analyze = (
-        "You are an automated code refactoring tool. I will provide a changelog for a library update and a user's code file. "
-        "Your task is to rewrite the entire code file to be compatible with the new version, applying any necessary breaking changes from the changelog. "
-        "Respond with a JSON object containing a single key: 'new_content' (a string containing the complete, corrected file content). "
-        "Make sure the response is only the JSON object and nothing else."
+        "You are an automated code refactoring tool. I will provide a changelog for a library update and one or more of the user's code files. "
+        "Your task is to rewrite each code file to be compatible with the new version, applying any necessary breaking changes from the changelog. "
+        "Respond with a JSON object containing a single key: 'patches' (a list of objects, each with the keys 'path' (the file path exactly as given) "
+        "and 'new_content' (a string containing the complete, corrected file content)). "
+        "Make sure the response is only the JSON object and nothing else.\n\n"
+        f"Changelog for {package_name}:\n{changelog_content}"
     )
-    patched_files_report = []
-    for file_path, content in relevant_files.items():
-        print(Style.DIM + f"  - Generating patch for {os.path.basename(file_path)}...")
-        user_prompt_analyze = (f"Changelog for {package_name}:\n{changelog_content}\n\n"
-                               f"Rewrite the following code file to be compatible with the breaking changes described. Do not add any new functionality.\n"
-                               f"Code File Path: {file_path}\nOriginal Code Content:\n```javascript\n{content}\n```")
-        try:
-            response = client.chat.completions.create(model="gpt-4o", response_format={"type": "json_object"}, messages=[{"role": "system", "content": system_prompt_analyze}, {"role": "user", "content": user_prompt_analyze}], temperature=0.0)
-            analysis = json.loads(response.choices[0].message.content)
-            if analysis.get("new_content") and analysis.get("new_content") != content:
-                patched_files_report.append({"file": file_path, "original_content": content, "new_content": analysis["new_content"]})
-        except Exception as e:
-            print(Fore.YELLOW + f"Warning: Could not generate patch for {file_path}. {e}"); continue
-    return patched_files_report
+    # The system prompt (instructions + changelog) is built once and is byte-identical for every batch,
+    # so OpenAI's prompt caching can reuse it; only the files in the user message vary.
+    return asyncio.run(_get_code_patches_async(system_prompt_analyze, relevant_files, model, escalate_model))
+
+async def _get_code_patches_async(system_prompt, relevant_files, model, escalate_model):
+    can_escalate = escalate_model and escalate_model != model
+    # Batches are sent concurrently; the semaphore bounds how many requests are in flight per package.
+    semaphore = asyncio.Semaphore(PATCH_CONCURRENCY)
+
+    async def patch_batch(aclient, batch):
+        async with semaphore:
+            log(Style.DIM + f"  - Generating patches for {', '.join(os.path.basename(p) for p in batch)}...")
+            try:
+                try: patches = await request_patches(aclient, system_prompt, batch, model)
+                except json.JSONDecodeError:
+                    if not can_escalate: raise
+                    patches = {}
+                # Files the cheaper model returned unusable or unchanged content for get one retry on the stronger model.
+                unpatched = {file_path: content for file_path, content in batch.items() if file_path not in patches}
+                if unpatched and can_escalate:
+                    log(Style.DIM + f"  - Retrying {len(unpatched)} file(s) with {escalate_model}...")
+                    patches.update(await request_patches(aclient, system_prompt, unpatched, escalate_model))
+                return [{"file": file_path, "original_content": batch[file_path], "new_content": new_content} for file_path, new_content in patches.items()]
+            except Exception as e:
+                log(Fore.YELLOW + f"Warning: Could not generate patches for {', '.join(batch)}. {e}"); return []
+
+    # The async client is tied to the event loop, so each asyncio.run() call gets its own.
+    async with AsyncOpenAI() as aclient:
+        results = await asyncio.gather(*(patch_batch(aclient, batch) for batch in batch_files(relevant_files)))
+    return [patch for batch_patches in results for patch in batch_patches]
 
 def apply_code_patches(patched_files, package_name):
     if not patched_files: return True
@@ -143,12 +356,16 @@ def apply_code_patches(patched_files, package_name):
     for patch in patched_files:
         file_path, original, new = patch['file'], patch['original_content'], patch['new_content']
         print(Style.BRIGHT + f"\n--- Patch for: {Fore.YELLOW}{file_path} ---")
-        diff = difflib.unified_diff(original.splitlines(keepends=True), new.splitlines(keepends=True), fromfile='original', tofile='proposed')
-        for line in diff:
-            if line.startswith('+'): print(Fore.GREEN + line, end="")
-            elif line.startswith('-'): print(Fore.RED + line, end="")
-            elif line.startswith('^'): print(Fore.BLUE + line, end="")
-            else: print(Style.DIM + line, end="")
+        original_lines, new_lines = original.splitlines(keepends=True), new.splitlines(keepends=True)
+        if max(len(original_lines), len(new_lines)) > MAX_DIFF_LINES:
+            print(Fore.YELLOW + f"(Diff not shown: file is too large, {len(original_lines)} -> {len(new_lines)} lines. Review {file_path} after applying.)")
+        else:
+            # Build the colored diff in memory and emit it with a single write instead of one print per line.
+            out = []
+            for line in difflib.unified_diff(original_lines, new_lines, fromfile='original', tofile='proposed'):
+                color = Fore.GREEN if line.startswith('+') else Fore.RED if line.startswith('-') else Fore.BLUE if line.startswith('^') else Style.DIM
+                out.append(color + line + Style.RESET_ALL)
+            sys.stdout.write("".join(out)); sys.stdout.flush()
 
         try:
             proceed = input(Style.BRIGHT + "\nApply this patch? (y/n) ").lower() == 'y'
@@ -171,7 +388,7 @@ def update_packages(packages_to_update, pkg_json_path, all_missing_peers):
     project_dir = os.path.dirname(pkg_json_path)
     print(Fore.CYAN + Style.BRIGHT + f"\nUpdating {len(packages_to_update)} approved packages in package.json...")
     try:
-        with open(pkg_json_path, 'r') as f: pkg_data = json.load(f)
+        pkg_data = read_json(pkg_json_path)
         if all_missing_peers:
             print(Fore.CYAN + f"-> Adding {len(all_missing_peers)} missing peer dependencies...")
             if "dependencies" not in pkg_data: pkg_data["dependencies"] = {}
@@ -186,17 +403,70 @@ def update_packages(packages_to_update, pkg_json_path, all_missing_peers):
                     old_version_str = pkg_data[dep_type].get(pkg_name, ""); prefix = re.match(r"^[~^]?", old_version_str).group(0) or ""
                     pkg_data[dep_type][pkg_name] = f"{prefix}{new_version}"
                     print(f"  - Updating '{pkg_name}' to version '{prefix}{new_version}'")
-        with open(pkg_json_path, 'w') as f: json.dump(pkg_data, f, indent=2)
+        write_json(pkg_json_path, pkg_data)
         print(Fore.CYAN + "✅ package.json has been updated.")
         use_yarn = os.path.exists(os.path.join(project_dir, "yarn.lock"))
         install_command = "yarn install" if use_yarn else "npm install"
         print(Fore.CYAN + f"-> Running '{install_command}' to apply all changes...")
-        subprocess.run(install_command.split(), cwd=project_dir, check=True, capture_output=True, text=True)
+        # Stream the installer's output straight to the terminal instead of buffering it all in memory.
+        process = subprocess.Popen(install_command.split(), cwd=project_dir, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, bufsize=1)
+        for line in process.stdout: sys.stdout.write(Style.DIM + line + Style.RESET_ALL)
+        if process.wait() != 0: raise subprocess.CalledProcessError(process.returncode, install_command)
         print(Fore.CYAN + "✅ Lock file has been updated successfully.")
         return True
     except (FileNotFoundError, json.JSONDecodeError, subprocess.CalledProcessError, FileNotFoundError) as e:
         print(Fore.RED + f"❌ Error during update process:\n{e}"); return False
 
+def analyze_package(package_name, current_version_str, latest_info, all_packages, args, source_index):
+    if not isinstance(current_version_str, str) or not current_version_str: return None
+    _task_log.lines = []
+    try:
+        return _analyze_package(package_name, current_version_str, latest_info, all_packages, args, source_index)
+    finally:
+        lines, _task_log.lines = _task_log.lines, None
+        with PRINT_LOCK:
+            for line in lines: print(line)
+
+def _analyze_package(package_name, current_version_str, latest_info, all_packages, args, source_index):
+    log(Style.BRIGHT + f"\n--- Checking '{package_name}' ---")
+    current_version = re.sub(r"[^\d.]", "", current_version_str)
+    if not latest_info: return None
+    latest_version = latest_info.get("version")
+
+    # Skip the changelog + OpenAI pipeline when the declared range already covers the latest release.
+    if latest_version and satisfies_range(latest_version, current_version_str):
+        log(Fore.GREEN + f"-> Up to date (latest {latest_version} satisfies '{current_version_str}')."); return None
+    if not (latest_version and current_version and latest_version != current_version):
+        log(Fore.GREEN + "-> Up to date."); return None
+
+    log(f"-> Update found: {current_version} -> {latest_version}")
+    missing_peers = {p: v for p, v in latest_info.get('peerDependencies', {}).items() if p not in all_packages}
+    if missing_peers: log(Fore.YELLOW + f"-> Warning: Missing peer dependencies found: {', '.join(missing_peers.keys())}")
+
+    changelog = get_changelog(latest_info.get("repository", {}).get("url"), latest_info.get("repository", {}).get("directory"))
+    changelog = trim_changelog(changelog, current_version, latest_version) if changelog else "Could not retrieve changelog."
+    risk, summary = summarize_and_classify_changes(package_name, changelog, missing_peers, args.model)
+
+    patched_files = []; deep_scan_skipped = False
+    if (risk == "DANGEROUS" or risk == "CAUTION") and args.src:
+        # A CAUTION changelog with no breaking-change wording is almost always a bug-fix release; don't pay for per-file patches.
+        if risk == "CAUTION" and not BREAKING_CHANGE_SIGNALS.search(changelog):
+            log(Style.DIM + "-> No breaking-change signals in changelog; skipping deep scan."); deep_scan_skipped = True
+        else:
+            relevant_files = find_relevant_files(source_index, package_name)
+            if relevant_files:
+                patched_files = get_code_patches(package_name, changelog, relevant_files, args.model, args.escalate_model)
+
+    if patched_files:
+        log(Fore.YELLOW + f"-> Actionable code patches found. Promoting risk to DANGEROUS.")
+        risk = "DANGEROUS"
+
+    return {
+        "name": package_name, "current": current_version, "latest": latest_version,
+        "risk": risk, "summary": summary, "patched_files": patched_files, "missing_peers": missing_peers, "deep_scan_skipped": deep_scan_skipped,
+        "_rank": RISK_ORDER.get(risk, 3)
+    }
+
 # --- MAIN ORCHESTRATION ---
 def main():
     parser = argparse.ArgumentParser(description="Analyze dependencies, auto-patch code, and update packages.", formatter_class=argparse.RawTextHelpFormatter)
@@ -205,46 +475,22 @@ def main():
     parser.add_argument("--apply-patches", action="store_true", help="Enable the experimental AI code patching feature after review.")
     parser.add_argument("--risk", type=str, default='SAFE', help="Comma-separated risk levels to attempt to update (e.g., SAFE,CAUTION).")
     parser.add_argument("--yes", "-y", action="store_true", help="Skip all confirmation prompts (DANGEROUS: auto-applies patches).")
+    parser.add_argument("--model", type=str, default=DEFAULT_MODEL, help=f"OpenAI model used for changelog analysis and code patches (default: {DEFAULT_MODEL}).")
+    parser.add_argument("--escalate-model", type=str, default=DEFAULT_ESCALATE_MODEL, help=f"Model to retry a code patch with when --model returns invalid JSON or no change (default: {DEFAULT_ESCALATE_MODEL}).")
     args = parser.parse_args()
 
     all_packages = parse_package_json(args.file_path)
     if not all_packages: return
 
+    source_index = build_source_index(args.src)
     print(f"\nFound {len(all_packages)} total dependencies. Analyzing for updates...")
-    outdated_packages = []
-    for package_name, current_version_str in all_packages.items():
-        if not isinstance(current_version_str, str) or not current_version_str: continue
-
-        print(Style.BRIGHT + f"\n--- Checking '{package_name}' ---")
-        current_version = re.sub(r"[^\d.]", "", current_version_str)
-        latest_info = get_npm_package_info(package_name)
-        if not latest_info: continue
-        latest_version = latest_info.get("version")
-
-        if latest_version and current_version and latest_version != current_version:
-            print(f"-> Update found: {current_version} -> {latest_version}")
-            missing_peers = {p: v for p, v in latest_info.get('peerDependencies', {}).items() if p not in all_packages}
-            if missing_peers: print(Fore.YELLOW + f"-> Warning: Missing peer dependencies found: {', '.join(missing_peers.keys())}")
-
-            changelog = get_changelog(latest_info.get("repository", {}).get("url"), latest_info.get("repository", {}).get("directory")) or "Could not retrieve changelog."
-            risk, summary = summarize_and_classify_changes(package_name, changelog, missing_peers)
-
-            patched_files = []
-            if (risk == "DANGEROUS" or risk == "CAUTION") and args.src:
-                relevant_files = find_relevant_files(args.src, package_name)
-                if relevant_files:
-                    patched_files = get_code_patches(package_name, changelog, relevant_files)
-
-            if patched_files:
-                print(Fore.YELLOW + f"-> Actionable code patches found. Promoting risk to DANGEROUS.")
-                risk = "DANGEROUS"
-
-            outdated_packages.append({
-                "name": package_name, "current": current_version, "latest": latest_version,
-                "risk": risk, "summary": summary, "patched_files": patched_files, "missing_peers": missing_peers
-            })
-        else:
-            print(Fore.GREEN + "-> Up to date.")
+    latest_infos = fetch_latest_infos([name for name, version_str in all_packages.items() if isinstance(version_str, str) and version_str])
+    results = {}
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        futures = {executor.submit(analyze_package, name, version_str, latest_infos.get(name), all_packages, args, source_index): name for name, version_str in all_packages.items()}
+        for future in as_completed(futures):
+            results[futures[future]] = future.result()
+    outdated_packages = [results[name] for name in all_packages if results.get(name)]
 
     # --- Auto-updating and Final Report Logic ---
     auto_update_levels = [level.strip().upper() for level in args.risk.split(',')]
@@ -286,8 +532,7 @@ def main():
     if packages_to_report:
         print(Fore.YELLOW + Style.BRIGHT + "\n⚠️ Manual Review Required")
         print(Fore.YELLOW + "---------------------------\n")
-        risk_order = {"DANGEROUS": 0, "CAUTION": 1, "SAFE": 2, "UNKNOWN": 3}
-        packages_to_report.sort(key=lambda p: risk_order.get(p["risk"], 3))
+        packages_to_report.sort(key=itemgetter("_rank"))
         for pkg in packages_to_report:
             risk = pkg["risk"]
             color = Fore.RED if risk == "DANGEROUS" else Fore.YELLOW if risk == "CAUTION" else Fore.WHITE
@@ -302,6 +547,8 @@ def main():
                 print(Style.BRIGHT + "\nProposed Patches (run with --apply-patches to apply):")
                 for item in pkg['patched_files']:
                     print(f"  - {Fore.CYAN}{os.path.relpath(item['file'])}")
+            elif pkg.get('deep_scan_skipped'):
+                print(Style.DIM + "\nDeep scan skipped: the changelog mentions no breaking changes, removals, deprecations or migrations.")
 
     if not updated_packages_list and not packages_to_report:
         print(Fore.GREEN + "\n✅ All dependencies are already up to date!")